@@ -23,22 +23,36 @@ License: MIT
 """
 
 import logging
+import logging.handlers
+import atexit
+import queue
 import os
 import re
 import asyncio
 import json
+import csv
+import time
 import io # NEW: For sending user list as a file
-from typing import Optional, Tuple, Dict, Any
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from typing import Optional, Tuple, Dict, Any, List, Iterable, Set, Union, Type
 from datetime import datetime, timezone
 
 # --- NEW: Firebase Admin SDK ---
 import firebase_admin
 from firebase_admin import credentials, firestore
 
-from pyrogram import Client, filters
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-from pyrogram.enums import ParseMode, PollType
-from pyrogram.errors import MessageNotModified
+from pyrogram import Client, filters, raw, utils
+from pyrogram.types import (
+    Message, InlineKeyboardMarkup, InlineKeyboardButton,
+    InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio
+)
+from pyrogram.enums import ParseMode, PollType, ChatType
+from pyrogram.errors import (
+    MessageNotModified, FloodWait, RPCError, ChatAdminRequired, UserNotParticipant,
+    MessageIdInvalid, ChannelPrivate, PeerIdInvalid
+)
 
 # ==================== CONFIGURATION ====================
 
@@ -52,6 +66,10 @@ class Config:
         BOT_TOKEN: Bot token from @BotFather
         OWNER_ID: Your Telegram User ID for admin commands
         FIREBASE_SERVICE_ACCOUNT_JSON: JSON content of your Google Firebase service account key
+    
+    Optional:
+        MAX_CONCURRENT: Pyrogram max_concurrent_transmissions, i.e. parallel
+            file uploads/downloads (default: 4). Copies by file_id don't use it.
     """
     
     # Load environment variables
@@ -60,6 +78,7 @@ class Config:
     BOT_TOKEN: Optional[str] = None
     OWNER_ID: Optional[int] = None # --- NEW: Now required for admin features ---
     FIREBASE_SERVICE_ACCOUNT_JSON: Optional[str] = None # --- NEW: For Firebase ---
+    MAX_CONCURRENT: int = 4
     
     @classmethod
     def load(cls) -> bool:
@@ -77,6 +96,9 @@ class Config:
             cls.OWNER_ID = int(os.environ.get("OWNER_ID", 0)) # --- NEW ---
             cls.FIREBASE_SERVICE_ACCOUNT_JSON = os.environ.get("FIREBASE_SERVICE_ACCOUNT_JSON") # --- NEW ---
             
+            # Optional tuning
+            cls.MAX_CONCURRENT = max(1, int(os.environ.get("MAX_CONCURRENT", 4)))
+            
             # Validate required variables
             if not all([cls.API_ID, cls.API_HASH, cls.BOT_TOKEN]):
                 logging.critical("Missing required env vars (API_ID, API_HASH, BOT_TOKEN)")
@@ -93,21 +115,38 @@ class Config:
             return True
             
         except ValueError as e:
-            logging.critical(f"Configuration error: {e}")
+            logging.critical("Configuration error: %s", e)
             return False
 
 
 # ==================== LOGGING SETUP ====================
 
+class _RawQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that enqueues the record as-is; the listener thread formats it."""
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock prepare() merges args and formats tracebacks in the caller's thread
+        return record
+
 def setup_logging():
-    """Configure logging with appropriate format and level."""
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler()
-        ]
+    """
+    Configure logging with appropriate format and level.
+    Records are queued unformatted by the caller and formatted/written on a
+    listener thread, so a log call on the event loop costs only a queue put.
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     )
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop) # Flush queued records on exit
+    # Added by hand: basicConfig would give the QueueHandler a formatter too,
+    # and records would then be formatted twice
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(_RawQueueHandler(log_queue))
 
 setup_logging()
 logger = logging.getLogger(__name__)
@@ -116,13 +155,33 @@ logger = logging.getLogger(__name__)
 
 db = None # Firestore client global variable
 
+# The Firestore SDK is blocking; its calls run here so they never stall the event loop
+_DB_EXECUTOR = ThreadPoolExecutor(max_workers=40, thread_name_prefix="firestore")
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking Firestore call on the DB thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_DB_EXECUTOR, functools.partial(func, *args, **kwargs))
+
+_service_account_info: Optional[Dict[str, Any]] = None # Parsed once, reused on re-init
+
+def _warm_up_firestore():
+    """Open the gRPC channel and fetch an auth token before the first real request."""
+    try:
+        # Also seeds the user counter, so new users only ever Increment a seeded total
+        _seed_user_counter()
+        logger.info("Firestore connection warmed up.")
+    except Exception as e:
+        logger.warning("Firestore warm-up failed: %s", e)
+
 def init_firebase():
     """Initialize the Firebase Admin SDK and Firestore client."""
-    global db
+    global db, _service_account_info
     try:
         # Parse the service account JSON from the environment variable
-        service_account_info = json.loads(Config.FIREBASE_SERVICE_ACCOUNT_JSON)
-        cred = credentials.Certificate(service_account_info)
+        if _service_account_info is None:
+            _service_account_info = json.loads(Config.FIREBASE_SERVICE_ACCOUNT_JSON)
+        cred = credentials.Certificate(_service_account_info)
         
         # Initialize only if no app is already initialized
         if not firebase_admin._apps:
@@ -130,12 +189,56 @@ def init_firebase():
             
         db = firestore.client()
         logger.info("Firebase Firestore client initialized successfully.")
+        # Runs on the DB pool at import time, so no event loop is needed
+        _DB_EXECUTOR.submit(_warm_up_firestore)
     except Exception as e:
-        logger.critical(f"Failed to initialize Firebase: {e}", exc_info=True)
+        logger.critical("Failed to initialize Firebase: %s", e, exc_info=True)
         db = None
 
+# --- Ban status cache: user_id -> (is_banned, expires_at on time.monotonic()) ---
+BAN_CACHE: Dict[int, Tuple[bool, float]] = {}
+BAN_CACHE_TTL = 300 # seconds
+BAN_CACHE_MAX = 10000 # Expired entries are pruned once this many are held
+
+def cache_ban_status(user_id: int, is_banned: bool) -> None:
+    """Remember a user's ban status for BAN_CACHE_TTL seconds."""
+    now = time.monotonic()
+    if user_id not in BAN_CACHE and len(BAN_CACHE) >= BAN_CACHE_MAX:
+        for uid in [u for u, (_, expires_at) in BAN_CACHE.items() if expires_at <= now]:
+            del BAN_CACHE[uid]
+    BAN_CACHE[user_id] = (is_banned, now + BAN_CACHE_TTL)
+
 # --- NEW: Database Helper Functions ---
 
+# Users whose document is known to exist; /start for them is a single blind write.
+# A dict used as an insertion-ordered set, capped like PEER_CACHE.
+_KNOWN_USERS: Dict[int, None] = {}
+KNOWN_USERS_MAX = 10000
+
+@firestore.transactional
+def _upsert_user(transaction, user_ref, user_data):
+    """
+    Create or update a user document inside a transaction.
+    Returns (stored_data, created). A new user also bumps the stats counter,
+    but only once it has been seeded; an unseeded counter is later seeded
+    from a count() that already includes this user.
+    """
+    snapshot = user_ref.get(transaction=transaction)
+    if snapshot.exists:
+        existing = snapshot.to_dict()
+        if 'is_banned' not in existing:
+            user_data = dict(user_data, is_banned=False) # Backfill missing field
+        transaction.set(user_ref, user_data, merge=True)
+        return existing, False
+    
+    # Read (and so lock) the shared counter only for new users; still before any write
+    stats = _stats_ref().get(transaction=transaction)
+    new_data = dict(user_data, is_banned=False, joined_date=firestore.SERVER_TIMESTAMP)
+    transaction.set(user_ref, new_data)
+    if stats.exists and (stats.to_dict() or {}).get('total') is not None:
+        transaction.update(_stats_ref(), {'total': firestore.Increment(1)})
+    return new_data, True
+
 async def add_or_update_user(user, is_start=False):
     """Add or update user info in Firestore."""
     if not db:
@@ -143,99 +246,204 @@ async def add_or_update_user(user, is_start=False):
     
     try:
         user_ref = db.collection('users').document(str(user.id))
-        user_doc = user_ref.get()
-
         user_data = {
             'first_name': user.first_name,
             'username': user.username or '',
             'last_seen': firestore.SERVER_TIMESTAMP
         }
 
-        if not user_doc.exists:
-            # New user
-            user_data['is_banned'] = False
-            user_data['joined_date'] = firestore.SERVER_TIMESTAMP
-            user_ref.set(user_data)
-            logger.info(f"New user {user.id} ({user.first_name}) added to Firestore.")
+        if user.id in _KNOWN_USERS:
+            # Already seen this process: merge-write without reading first
+            await run_db(user_ref.set, user_data, merge=True)
+            user_data['is_banned'] = await is_banned_cached(user.id)
             return user_data
-        else:
-            # Existing user
-            user_data_existing = user_doc.to_dict()
-            if 'is_banned' not in user_data_existing:
-                user_data['is_banned'] = False # Backfill missing field
-            
-            user_ref.update(user_data)
+
+        # First sighting: the transaction decides new vs existing atomically
+        stored, created = await run_db(_upsert_user, db.transaction(), user_ref, user_data)
+        if len(_KNOWN_USERS) >= KNOWN_USERS_MAX:
+            _KNOWN_USERS.pop(next(iter(_KNOWN_USERS))) # Drop the oldest entry
+        _KNOWN_USERS[user.id] = None
+        cache_ban_status(user.id, stored.get('is_banned', False))
+        if created:
+            _bump_cached_user_count()
+            logger.info("New user %s (%s) added to Firestore.", user.id, user.first_name)
+        elif is_start:
             # Log only on start, not every message
-            if is_start:
-                logger.info(f"User {user.id} ({user.first_name}) updated (re-started).")
-            return user_doc.to_dict() # Return existing data
+            logger.info("User %s (%s) updated (re-started).", user.id, user.first_name)
+        return stored
 
     except Exception as e:
-        logger.error(f"Failed to add/update user {user.id}: {e}")
+        logger.error("Failed to add/update user %s: %s", user.id, e)
         return None
 
+# --- Batched profile/last_seen writes for the per-message path ---
+USER_UPDATE_BATCH_SIZE = 450 # Firestore caps a WriteBatch at 500 writes
+USER_UPDATE_FLUSH_INTERVAL = 2.0 # seconds
+_user_update_queue: Optional[asyncio.Queue] = None
+_user_update_writer: Optional[asyncio.Task] = None
+
+def queue_user_update(user) -> None:
+    """
+    Queue a profile/last_seen update without waiting on Firestore.
+    
+    Updates are merged into the user document by a background writer in
+    WriteBatch chunks. A user not yet known to exist goes through
+    add_or_update_user instead, so new-user setup (is_banned, joined_date,
+    the stats counter) is never skipped by a blind merge.
+    """
+    global _user_update_queue, _user_update_writer
+    if not db:
+        return
+    if user.id not in _KNOWN_USERS:
+        spawn(add_or_update_user(user))
+        return
+    if _user_update_queue is None:
+        _user_update_queue = asyncio.Queue()
+    if _user_update_writer is None or _user_update_writer.done():
+        _user_update_writer = asyncio.create_task(_write_user_updates())
+    _user_update_queue.put_nowait((user.id, {
+        'first_name': user.first_name,
+        'username': user.username or '',
+        'last_seen': firestore.SERVER_TIMESTAMP
+    }))
+
+def _commit_user_updates(pending: Dict[int, Dict[str, Any]]) -> None:
+    try:
+        batch = db.batch()
+        for user_id, user_data in pending.items():
+            batch.set(db.collection('users').document(str(user_id)), user_data, merge=True)
+        batch.commit()
+        logger.debug("Flushed %d user updates to Firestore", len(pending))
+    except Exception as e:
+        logger.error("Failed to flush %d user updates: %s", len(pending), e)
+
+async def _write_user_updates() -> None:
+    """Drain the update queue, flushing every USER_UPDATE_FLUSH_INTERVAL or USER_UPDATE_BATCH_SIZE users."""
+    loop = asyncio.get_running_loop()
+    while True:
+        user_id, user_data = await _user_update_queue.get()
+        pending = {user_id: user_data} # Keyed by user, so repeat messages collapse to one write
+        deadline = loop.time() + USER_UPDATE_FLUSH_INTERVAL
+        while len(pending) < USER_UPDATE_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                user_id, user_data = await asyncio.wait_for(_user_update_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            pending[user_id] = user_data
+        await run_db(_commit_user_updates, pending)
+
 async def get_user_data(user_id):
     """Get user data (including ban status) from Firestore."""
     if not db:
         return None
     try:
         user_ref = db.collection('users').document(str(user_id))
-        user_doc = user_ref.get()
+        user_doc = await run_db(user_ref.get)
         if user_doc.exists:
             return user_doc.to_dict()
         return None # User not found
     except Exception as e:
-        logger.error(f"Failed to get user data {user_id}: {e}")
+        logger.error("Failed to get user data %s: %s", user_id, e)
         return None
 
+async def is_banned_cached(user_id: int) -> bool:
+    """Return the user's ban status, reading Firestore only when the cache entry is stale."""
+    entry = BAN_CACHE.get(user_id)
+    if entry and time.monotonic() < entry[1]:
+        return entry[0]
+    user_data = await get_user_data(user_id)
+    is_banned = bool(user_data and user_data.get('is_banned', False))
+    cache_ban_status(user_id, is_banned)
+    return is_banned
+
 async def set_ban_status(user_id: int, status: bool):
     """Set the ban status for a user."""
     if not db:
         return False, "Database not connected"
     try:
         user_ref = db.collection('users').document(str(user_id))
-        user_ref.update({'is_banned': status})
-        logger.info(f"User {user_id} ban status set to {status}")
+        await run_db(user_ref.update, {'is_banned': status})
+        cache_ban_status(user_id, status) # Takes effect immediately, no stale cache
+        logger.info("User %s ban status set to %s", user_id, status)
         return True, "Success"
     except Exception as e:
-        logger.error(f"Failed to set ban status for {user_id}: {e}")
+        logger.error("Failed to set ban status for %s: %s", user_id, e)
         return False, str(e)
 
+# --- Denormalized user counter: stats/users.total, cached in-process ---
+USER_COUNT_TTL = 60 # seconds
+_user_count_cache: Optional[Tuple[int, float]] = None # (total, expires_at on time.monotonic())
+
+def _stats_ref():
+    return db.collection('stats').document('users')
+
+def _seed_user_counter() -> int:
+    """
+    Return stats/users.total, seeding it first from a count() aggregation
+    if it is missing (first run on an existing deployment, or counter lost).
+    Blocking; call it on the DB pool.
+    """
+    stats_doc = _stats_ref().get()
+    total = (stats_doc.to_dict() or {}).get('total') if stats_doc.exists else None
+    if total is None:
+        total = db.collection('users').count().get()[0][0].value
+        _stats_ref().set({'total': total}, merge=True)
+        logger.info("Seeded stats/users counter with %d users.", total)
+    return total
+
+def _bump_cached_user_count() -> None:
+    global _user_count_cache
+    if _user_count_cache:
+        _user_count_cache = (_user_count_cache[0] + 1, _user_count_cache[1])
+
 async def get_user_count():
-    """Get total user count from Firestore."""
+    """Get total user count from the stats/users counter document."""
+    global _user_count_cache
     if not db:
         return 0
+    if _user_count_cache and time.monotonic() < _user_count_cache[1]:
+        return _user_count_cache[0]
     try:
-        # This gets the count efficiently
-        count_query = db.collection('users').count()
-        count_result = count_query.get()
-        return count_result[0][0].value
+        total = await run_db(_seed_user_counter)
+        _user_count_cache = (total, time.monotonic() + USER_COUNT_TTL)
+        return total
     except Exception as e:
-        logger.error(f"Failed to get user count: {e}")
+        logger.error("Failed to get user count: %s", e)
         return 0
 
-async def get_all_users_from_db():
-    """Get all users from Firestore."""
+USERS_PAGE_SIZE = 500
+
+async def iter_users(page_size: int = USERS_PAGE_SIZE):
+    """
+    Yield every user document, one Firestore page at a time.
+
+    Pages are walked with a start_after() cursor so only one page is held in
+    memory and each blocking fetch runs on the DB pool.
+    """
     if not db:
-        return []
-    try:
-        users_stream = db.collection('users').stream()
-        users_list = []
-        # Add user_id to the dict as it's the document ID
-        for doc in users_stream:
-            user_data = doc.to_dict()
-            user_data['user_id'] = doc.id
-            users_list.append(user_data)
-        return users_list
-    except Exception as e:
-        logger.error(f"Failed to get all users: {e}")
-        return []
+        return
+    query = db.collection('users').order_by('__name__').limit(page_size)
+    while True:
+        docs = await run_db(lambda q=query: list(q.stream()))
+        for doc in docs:
+            yield doc
+        if len(docs) < page_size:
+            break
+        query = query.start_after(docs[-1])
 
 # ==================== BOT INITIALIZATION ====================
 
 # Load configuration
 config_valid = Config.load()
 
+# Freeze the loaded values into module constants; they never change after load()
+API_ID, API_HASH, BOT_TOKEN = Config.API_ID, Config.API_HASH, Config.BOT_TOKEN
+OWNER_ID: Optional[int] = Config.OWNER_ID or None
+MAX_CONCURRENT = Config.MAX_CONCURRENT
+
 # --- NEW: Initialize Firebase ---
 if config_valid:
     init_firebase()
@@ -246,177 +454,584 @@ else:
 if config_valid and db: # --- NEW: Check for DB connection ---
     app = Client(
         name="content_saver_bot",
-        api_id=Config.API_ID,
-        api_hash=Config.API_HASH,
-        bot_token=Config.BOT_TOKEN,
+        api_id=API_ID,
+        api_hash=API_HASH,
+        bot_token=BOT_TOKEN,
         in_memory=True,
+        max_concurrent_transmissions=MAX_CONCURRENT, # Uploads/downloads only, not the copy path
+        sleep_threshold=30, # Absorb short FLOOD_WAITs inside Pyrogram instead of raising
     )
     logger.info("Bot client initialized successfully")
+    # Pyrogram picks up tgcrypto by itself; say so, since a build without it
+    # silently falls back to pure-Python AES for every MTProto packet
+    try:
+        import tgcrypto # noqa: F401
+        logger.info("tgcrypto accelerated crypto loaded")
+    except ImportError:
+        logger.warning("tgcrypto not installed; MTProto encryption runs in pure Python (slow)")
 else:
     logger.error("Bot client not initialized due to invalid configuration or DB failure")
     app = None
 
 # --- State tracking for /cancel command ---
-ACTIVE_BATCHES: Dict[int, bool] = {}
+CANCEL_EVENTS: Dict[int, asyncio.Event] = {}
+
+# --- Last time each chat got the "send a valid link" hint (loop time) ---
+HINT_SENT_AT: Dict[int, float] = {}
+HINT_COOLDOWN = 3.0
+HINT_SENT_AT_MAX = 1024 # Expired timestamps are pruned once this many are held
 
 
 # ==================== HELPER FUNCTIONS ====================
 
-# --- NEW: Admin check function ---
-def is_owner(user_id: int) -> bool:
-    """Check if the user ID matches the OWNER_ID."""
-    return user_id == Config.OWNER_ID
+# --- Per-chat send pacing (replaces the fixed 0.5s sleep between batch items) ---
+class RateLimiter:
+    """
+    Token-bucket pacing for sends to a single destination chat.
+    
+    Up to `burst` sends go out back to back; after that each acquire()
+    reserves the next free slot, `interval` seconds apart (~1 msg/s is
+    Telegram's per-chat limit). The reservation is made before sleeping,
+    so concurrent callers queue up without holding anything while they wait.
+    
+    A `parent` limiter, if given, is acquired after this one's slot, so
+    per-chat sends also respect the bot-wide rate.
+    
+    Pacing alone doesn't order concurrent sends, so callers that need the
+    source order kept hold `send_lock` across acquire() and the send.
+    """
+    
+    def __init__(self, interval: float = 1.0, burst: int = 3, parent: Optional["RateLimiter"] = None):
+        self.interval = interval
+        self.parent = parent
+        self.send_lock = asyncio.Lock()
+        self.tolerance = (burst - 1) * interval # How far ahead of schedule a burst may run
+        self.next_allowed = 0.0 # Theoretical time of the next send at the steady rate
+    
+    async def acquire(self) -> None:
+        """Wait until the next send slot for this chat is available."""
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self.next_allowed)
+        self.next_allowed = slot + self.interval
+        delay = slot - self.tolerance - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.parent:
+            await self.parent.acquire()
+    
+    def penalize(self, seconds: float) -> None:
+        """Push the next slot back (and drain the burst) after a FLOOD_WAIT."""
+        now = asyncio.get_running_loop().time()
+        self.next_allowed = max(self.next_allowed, now + seconds + self.tolerance)
+
+
+RATE_LIMITERS: Dict[int, RateLimiter] = {}
+RATE_LIMITERS_MAX = 1024 # Idle limiters are pruned once this many exist
+PRIVATE_CHAT_INTERVAL = 1.0 # ~1 msg/s to a user
+GROUP_CHAT_INTERVAL = 3.0 # ~20 msg/min to a group or channel
+GLOBAL_SEND_RATE = 25 # msg/s across all chats, under Telegram's ~30/s bot limit
+GLOBAL_LIMITER = RateLimiter(1 / GLOBAL_SEND_RATE, burst=5)
+
+def get_rate_limiter(chat_id: int) -> RateLimiter:
+    """Return the RateLimiter for a destination chat, creating it on first use."""
+    limiter = RATE_LIMITERS.get(chat_id)
+    if limiter is None:
+        if len(RATE_LIMITERS) >= RATE_LIMITERS_MAX:
+            _prune_rate_limiters()
+        # Users have positive ids; groups and channels negative ones
+        interval = PRIVATE_CHAT_INTERVAL if chat_id > 0 else GROUP_CHAT_INTERVAL
+        limiter = RATE_LIMITERS[chat_id] = RateLimiter(interval, parent=GLOBAL_LIMITER)
+    return limiter
+
+def _prune_rate_limiters() -> None:
+    """
+    Drop limiters that are idle: their next slot is already in the past and
+    nobody holds their send_lock, so a fresh limiter would behave the same.
+    """
+    now = asyncio.get_running_loop().time()
+    idle = [
+        chat_id for chat_id, limiter in RATE_LIMITERS.items()
+        if limiter.next_allowed <= now and not limiter.send_lock.locked()
+    ]
+    for chat_id in idle:
+        del RATE_LIMITERS[chat_id]
+
+# --- Fire-and-forget replies ---
+_BACKGROUND_TASKS: Set[asyncio.Task] = set()
+
+def _on_background_done(task: asyncio.Task) -> None:
+    _BACKGROUND_TASKS.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error("Background task failed: %s", task.exception())
+
+def spawn(coro) -> asyncio.Task:
+    """
+    Schedule a coroutine without awaiting it.
+    
+    Used for replies whose result the handler does not need, so the handler
+    returns to the dispatcher without waiting on the Telegram round-trip.
+    A reference is kept until the task finishes so it is not garbage collected.
+    """
+    task = asyncio.create_task(coro)
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_on_background_done)
+    return task
+
+# --- Per-chat ordered work queues ---
+CHAT_QUEUES: Dict[int, asyncio.Queue] = {}
+
+def enqueue_for_chat(chat_id: int, coro) -> None:
+    """
+    Run a coroutine after all earlier ones queued for the same chat.
+    
+    Each chat gets its own worker task, so a slow job in one chat never
+    delays another chat, while jobs within a chat keep their order.
+    """
+    chat_queue = CHAT_QUEUES.get(chat_id)
+    if chat_queue is None:
+        chat_queue = CHAT_QUEUES[chat_id] = asyncio.Queue()
+        spawn(_drain_chat_queue(chat_id, chat_queue))
+    chat_queue.put_nowait(coro)
+
+async def _drain_chat_queue(chat_id: int, chat_queue: asyncio.Queue) -> None:
+    """Worker for one chat; exits (and drops the queue) once it runs dry."""
+    while not chat_queue.empty():
+        coro = chat_queue.get_nowait()
+        try:
+            await coro
+        except Exception as e:
+            logger.error("Queued job for chat %s failed: %s", chat_id, e)
+    # No await between the empty() check and this, so no job can slip in unseen
+    del CHAT_QUEUES[chat_id]
+
+# --- Commands with their own handlers; the link handler skips these ---
+_BOT_COMMANDS = frozenset({"start", "batch_download", "cancel", "admin", "ban", "unban"})
+
+def _is_bot_command(text: str) -> bool:
+    """True if the text is one of _BOT_COMMANDS (with or without @botname)."""
+    if not text.startswith("/"):
+        return False
+    parts = text[1:].split(maxsplit=1)
+    return bool(parts) and parts[0].split("@", 1)[0].lower() in _BOT_COMMANDS
+
+def _incoming_private_text(message: Message) -> bool:
+    """Text in a private chat, not sent by the bot itself and not one of its commands."""
+    text = message.text
+    if not text or message.chat.type != ChatType.PRIVATE or message.outgoing:
+        return False
+    if message.from_user and message.from_user.is_self:
+        return False
+    return not _is_bot_command(text)
+
+# Each link handler filter is one predicate instead of a chain of AndFilters.
+# They are coroutines because Pyrogram runs plain-function filters in a thread pool.
+async def _link_message(_, __, message: Message) -> bool:
+    """Filter: incoming private text containing a link; the match goes in message.matches."""
+    if not _incoming_private_text(message):
+        return False
+    match = _LINK_EXTRACT_RE.search(message.text)
+    if match is None:
+        return False
+    message.matches = [match]
+    return True
+
+async def _non_link_message(_, __, message: Message) -> bool:
+    """Filter: incoming private text without a link."""
+    return _incoming_private_text(message) and not _LINK_EXTRACT_RE.search(message.text)
+
+link_message = filters.create(_link_message)
+non_link_message = filters.create(_non_link_message)
+
+async def _reject_all(_, __, ___) -> bool:
+    return False
 
-# --- All existing helper functions (parse_telegram_link, send_message_by_type, etc.)
-# --- are kept exactly as they were. ---
+# Rejects non-owner updates in the dispatcher, before the admin handlers run
+owner_only = filters.user(OWNER_ID) if OWNER_ID else filters.create(_reject_all)
+
+# --- Link patterns, compiled once at import instead of on every message ---
+# Single message (/123) and range (/123-456) links share one pattern
+_LINK_RE = re.compile(r"https?://t\.me/(?P<channel>[^/]+)/(?P<start>\d+)(?:-(?P<end>\d+))?")
+_LINK_EXTRACT_RE = re.compile(r'https?://(?:t\.me|telegram\.me)/\S+')
 
 def parse_telegram_link(link: str) -> Optional[Dict[str, Any]]:
     link = link.strip().replace(" ", "") # Remove spaces
-    patterns = [
-        (r"https?://t\.me/([^/]+)/(\d+)-(\d+)$", "public_batch"),
-        (r"https?://t\.me/([^/]+)/(\d+)$", "public")
-    ]
-    for pattern, link_type in patterns:
-        match = re.match(pattern, link)
-        if match:
-            if link_type == "public_batch":
-                return {
-                    "type": "public",
-                    "channel": match.group(1),
-                    "topic_id": None,
-                    "message_id_start": int(match.group(2)),
-                    "message_id_end": int(match.group(3))
-                }
-            elif link_type == "public":
-                msg_id = int(match.group(2))
-                return {
-                    "type": "public",
-                    "channel": match.group(1),
-                    "topic_id": None,
-                    "message_id_start": msg_id,
-                    "message_id_end": msg_id
-                }
-    return None
+    if not link.startswith(("https://t.me/", "http://t.me/")):
+        return None # Cheap reject before running any regex
+    match = _LINK_RE.fullmatch(link)
+    if not match:
+        return None
+    start = int(match["start"])
+    return {
+        "type": "public",
+        "channel": match["channel"],
+        "message_id_start": start,
+        "message_id_end": int(match["end"]) if match["end"] else start
+    }
 
-async def send_message_by_type(client: Client, original_msg: Message, to_chat_id: int) -> Tuple[bool, Optional[str]]:
-    try:
-        if original_msg.poll:
-            return False, "Polls cannot be manually recreated by bots (API limitation)"
-        if original_msg.text:
-            await client.send_message(
-                chat_id=to_chat_id, text=original_msg.text.html, parse_mode=ParseMode.HTML
-            )
-        elif original_msg.photo:
-            await client.send_photo(
-                chat_id=to_chat_id, photo=original_msg.photo.file_id,
-                caption=original_msg.caption.html if original_msg.caption else None, parse_mode=ParseMode.HTML
-            )
-        elif original_msg.video:
-            await client.send_video(
-                chat_id=to_chat_id, video=original_msg.video.file_id,
-                caption=original_msg.caption.html if original_msg.caption else None, parse_mode=ParseMode.HTML
-            )
-        elif original_msg.document:
-            await client.send_document(
-                chat_id=to_chat_id, document=original_msg.document.file_id,
-                caption=original_msg.caption.html if original_msg.caption else None, parse_mode=ParseMode.HTML
-            )
-        elif original_msg.audio:
-            await client.send_audio(
-                chat_id=to_chat_id, audio=original_msg.audio.file_id,
-                caption=original_msg.caption.html if original_msg.caption else None, parse_mode=ParseMode.HTML
-            )
-        elif original_msg.voice:
-            await client.send_voice(
-                chat_id=to_chat_id, voice=original_msg.voice.file_id,
-                caption=original_msg.caption.html if original_msg.caption else None, parse_mode=ParseMode.HTML
-            )
-        elif original_msg.sticker:
-            await client.send_sticker(chat_id=to_chat_id, sticker=original_msg.sticker.file_id)
-        elif original_msg.animation:
-            await client.send_animation(
-                chat_id=to_chat_id, animation=original_msg.animation.file_id,
-                caption=original_msg.caption.html if original_msg.caption else None, parse_mode=ParseMode.HTML
-            )
+# --- Resolved chats: lower-cased username -> numeric chat id ---
+PEER_CACHE: Dict[str, Tuple[int, float]] = {} # -> (chat_id, expires_at on time.monotonic())
+PEER_CACHE_TTL = 8 * 60 * 60 # Same as Pyrogram's USERNAME_TTL; usernames can change hands
+PEER_CACHE_MAX = 1024
+# One lock per username being resolved, so concurrent links share one lookup
+_PEER_LOCKS: Dict[str, asyncio.Lock] = {}
+
+async def resolve_chat_id(client: Client, channel: str) -> int:
+    """
+    Resolve a public username to its numeric chat id, once per PEER_CACHE_TTL.
+    Calls within that window skip the username lookup entirely.
+    """
+    key = channel.lower()
+    cached = PEER_CACHE.get(key)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    
+    lock = _PEER_LOCKS.setdefault(key, asyncio.Lock())
+    async with lock:
+        cached = PEER_CACHE.get(key) # Filled while we waited?
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        try:
+            peer = await client.resolve_peer(channel)
+        finally:
+            # Waiters already hold the lock object; later callers hit the cache
+            _PEER_LOCKS.pop(key, None)
+        if isinstance(peer, raw.types.InputPeerChannel):
+            chat_id = utils.get_channel_id(peer.channel_id)
+        elif isinstance(peer, raw.types.InputPeerChat):
+            chat_id = -peer.chat_id
         else:
-            return False, "Unsupported message type"
-        return True, None
-    except Exception as e:
-        logger.error(f"Error sending message by type: {e}")
-        return False, str(e)
+            chat_id = peer.user_id
+        if key not in PEER_CACHE and len(PEER_CACHE) >= PEER_CACHE_MAX:
+            PEER_CACHE.pop(next(iter(PEER_CACHE))) # Drop the oldest entry
+        PEER_CACHE[key] = (chat_id, time.monotonic() + PEER_CACHE_TTL)
+        logger.debug("Resolved %s to chat id %s", channel, chat_id)
+    return chat_id
+
+_HTML = ParseMode.HTML # Bound once; used as parse_mode by the album builders below
+
+GET_MESSAGES_CHUNK = 100 # Matches BATCH_LIMIT, so a full batch is one call (get_messages takes up to 200)
+
+async def fetch_messages(client: Client, chat_id: int, msg_ids: Iterable[int]) -> Dict[int, Message]:
+    """
+    Fetch messages by id in chunks of GET_MESSAGES_CHUNK, chunks in parallel.
+    Returns the non-empty results keyed by message id.
+    """
+    ids = list(msg_ids)
+    chunks = [ids[i:i + GET_MESSAGES_CHUNK] for i in range(0, len(ids), GET_MESSAGES_CHUNK)]
+    results = await asyncio.gather(*(client.get_messages(chat_id, chunk) for chunk in chunks))
+    return {m.id: m for batch in results for m in batch if m and not m.empty}
+
+# Copy paths report failures as the raised exception, or a plain string for
+# problems found without a request ("Message not found", "Message is empty")
+CopyError = Union[str, Exception]
+
+FLOOD_WAIT_RETRIES = 3 # Retries of a flood-limited copy before falling back
+# Upper bound for one send request, so a stalled call fails instead of holding
+# up the batch. Longer than the client's sleep_threshold (30 s), so flood waits
+# that pyrogram sleeps through internally are not cut short.
+COPY_TIMEOUT = 45.0
+
+# --- Fetched source messages: (chat_id, message_id) -> (Message, expires_at on time.monotonic()) ---
+MESSAGE_CACHE: Dict[Tuple[int, int], Tuple[Message, float]] = {}
+MESSAGE_CACHE_TTL = 60 # seconds; many users pasting the same link share one fetch
+MESSAGE_CACHE_MAX = 1024
+
+async def get_message_cached(client: Client, chat_id: int, message_id: int) -> Optional[Message]:
+    """get_messages for a single id, served from MESSAGE_CACHE while fresh."""
+    key = (chat_id, message_id)
+    cached = MESSAGE_CACHE.get(key)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    msg = await client.get_messages(chat_id, message_id)
+    if msg and not msg.empty:
+        if len(MESSAGE_CACHE) >= MESSAGE_CACHE_MAX:
+            MESSAGE_CACHE.pop(next(iter(MESSAGE_CACHE))) # Drop the oldest entry
+        MESSAGE_CACHE[key] = (msg, time.monotonic() + MESSAGE_CACHE_TTL)
+    return msg
 
 async def copy_message_with_fallback(
-    client: Client, from_chat_id: int, message_id: int, to_chat_id: int,
-    message_thread_id: Optional[int] = None
-) -> Tuple[Optional[Message], Optional[str]]:
+    client: Client, from_chat_id: int, message_id: int, to_chat_id: int
+) -> Tuple[Optional[Message], Optional[CopyError]]:
+    try:
+        original_msg = await get_message_cached(client, from_chat_id, message_id)
+    except Exception as e:
+        logger.error("Unexpected error in copy_message_with_fallback: %s", e)
+        return None, e
+    
+    # A message from an album brings the whole album, re-sent in one request
+    if original_msg and not original_msg.empty and original_msg.media_group_id:
+        try:
+            album = await client.get_media_group(from_chat_id, message_id)
+            if all(_album_kind(m) for m in album):
+                error = await send_album(client, album, to_chat_id)
+                if not error:
+                    return original_msg, None
+                if isinstance(error, asyncio.TimeoutError):
+                    return None, error # May have been delivered; don't send it again
+                logger.warning("send_media_group failed for album of %s, copying the single message: %s", message_id, error)
+        except RPCError as e:
+            logger.warning("Could not fetch album of %s, copying the single message: %s", message_id, e)
+    
+    return await copy_prefetched(client, original_msg, to_chat_id, from_chat_id, message_id)
+
+async def copy_prefetched(
+    client: Client, original_msg: Optional[Message], to_chat_id: int,
+    from_chat_id: int, message_id: int
+) -> Tuple[Optional[Message], Optional[CopyError]]:
+    """Copy a message that was already fetched (e.g. by a batched get_messages)."""
     try:
-        original_msg = await client.get_messages(from_chat_id, message_id)
-        if not original_msg:
+        if not original_msg or original_msg.empty:
             return None, "Message not found"
-        if not original_msg.text and not original_msg.caption and not original_msg.media and not original_msg.poll:
+        text, caption, poll = original_msg.text, original_msg.caption, original_msg.poll
+        if not text and not caption and not original_msg.media and not poll:
             return None, "Message is empty"
         
-        if not original_msg.poll:
-            success, error = await send_message_by_type(client, original_msg, to_chat_id)
-            if success:
-                logger.info(f"Successfully copied message {message_id} using manual method")
-                return original_msg, None
-            if error:
-                 logger.warning(f"Manual copy failed for {message_id}. Falling back. Error: {error}")
-
-        try:
-            copied_msg = await client.copy_message(
-                chat_id=to_chat_id, from_chat_id=from_chat_id, message_id=message_id
-            )
-            if original_msg.poll:
-                logger.info(f"Successfully copied poll {message_id} using copy_message (API fallback)")
-            else:
-                 logger.info(f"Successfully copied message {message_id} using copy_message")
-            return copied_msg, None
-        except Exception as copy_error:
-            logger.warning(f"copy_message failed: {copy_error}")
+        # Message.copy re-sends the prefetched message with its entities intact in
+        # one request; client.copy_message would fetch the original again first.
+        limiter = get_rate_limiter(to_chat_id)
+        backoff = 0.0
+        for attempt in range(FLOOD_WAIT_RETRIES + 1):
+            try:
+                copied_msg = await asyncio.wait_for(original_msg.copy(to_chat_id), COPY_TIMEOUT)
+                logger.debug("Successfully copied message %s using copy", message_id)
+                return copied_msg, None
+            except FloodWait as e:
+                if attempt == FLOOD_WAIT_RETRIES:
+                    logger.warning("copy of %s still flood-limited after %s retries. Falling back.", message_id, attempt)
+                    break
+                # Wait at least what Telegram asked for, doubling on each retry
+                backoff = max(float(e.value), backoff * 2)
+                limiter.penalize(backoff)
+                await limiter.acquire()
+            except asyncio.TimeoutError as e:
+                # The copy may still have been delivered; a forward could duplicate it
+                logger.warning("copy of %s timed out after %ss; not falling back", message_id, COPY_TIMEOUT)
+                return None, e
+            except Exception as copy_error:
+                logger.warning("copy failed for %s. Falling back. Error: %s", message_id, copy_error)
+                break
         
         try:
-            forwarded_msg = await client.forward_messages(
-                chat_id=to_chat_id, from_chat_id=from_chat_id, message_ids=message_id
+            forwarded_msg = await asyncio.wait_for(
+                client.forward_messages(
+                    chat_id=to_chat_id, from_chat_id=from_chat_id, message_ids=message_id
+                ),
+                COPY_TIMEOUT
             )
-            logger.info(f"Successfully forwarded message {message_id}")
+            logger.debug("Successfully forwarded message %s", message_id)
             return forwarded_msg, None
         except Exception as forward_error:
-            logger.error(f"All methods failed. Last error: {forward_error}")
-            return None, str(forward_error)
+            if isinstance(forward_error, FloodWait):
+                limiter.penalize(forward_error.value)
+            logger.error("All methods failed for %s. Last error: %s", message_id, forward_error)
+            return None, forward_error
     
     except Exception as e:
-        logger.error(f"Unexpected error in copy_message_with_fallback: {e}")
-        return None, str(e)
+        logger.error("Unexpected error in copy_prefetched: %s", e)
+        return None, e
+
+# --- Album grouping for batches ---
+ALBUM_MAX_SIZE = 10 # Telegram's media group limit
 
-async def handle_copy_error(status_msg: Message, error: Exception) -> None:
-    error_msg = str(error)
-    if "MESSAGE_NOT_MODIFIED" in error_msg:
+def _album_kind(msg: Optional[Message]) -> Optional[str]:
+    """
+    Return the album family a message can be grouped into, or None.
+    
+    Photos and videos may share an album; documents and audio files can
+    only be grouped with their own kind.
+    """
+    if not msg or msg.empty:
+        return None
+    if msg.photo or msg.video:
+        return "visual"
+    if msg.document:
+        return "document"
+    if msg.audio:
+        return "audio"
+    return None
+
+def _to_input_media(msg: Message):
+    """Build the InputMedia for a prefetched message, reusing its file_id."""
+    # Uncaptioned items carry no caption fields at all, so nothing is HTML-parsed for them
+    caption_kwargs = {"caption": msg.caption.html, "parse_mode": _HTML} if msg.caption else {}
+    if msg.photo:
+        return InputMediaPhoto(msg.photo.file_id, **caption_kwargs)
+    if msg.video:
+        return InputMediaVideo(msg.video.file_id, **caption_kwargs)
+    if msg.document:
+        return InputMediaDocument(msg.document.file_id, **caption_kwargs)
+    return InputMediaAudio(msg.audio.file_id, **caption_kwargs)
+
+def plan_send_jobs(msg_ids: Iterable[int], originals_by_id: Dict[int, Message]) -> List[List[int]]:
+    """
+    Split a batch into send jobs, in message order.
+    
+    Consecutive messages of the same album kind are packed into jobs of up
+    to ALBUM_MAX_SIZE ids; everything else becomes a single-message job.
+    """
+    jobs: List[List[int]] = []
+    run_kind = None
+    for msg_id in msg_ids:
+        kind = _album_kind(originals_by_id.get(msg_id))
+        if kind and kind == run_kind and len(jobs[-1]) < ALBUM_MAX_SIZE:
+            jobs[-1].append(msg_id)
+        else:
+            jobs.append([msg_id])
+        run_kind = kind
+    return jobs
+
+async def send_album(client: Client, messages: List[Message], to_chat_id: int) -> Optional[Exception]:
+    """Send prefetched media messages as one album. Returns the exception on failure."""
+    try:
+        await asyncio.wait_for(
+            client.send_media_group(to_chat_id, media=[_to_input_media(m) for m in messages]),
+            COPY_TIMEOUT
+        )
+        return None
+    except Exception as e:
+        if isinstance(e, FloodWait):
+            get_rate_limiter(to_chat_id).penalize(e.value)
+        return e
+
+# --- Known copy errors -> user-facing message ---
+_ERROR_RESPONSES = {
+    "CHAT_ADMIN_REQUIRED": "❌ **Error:** Bot needs admin rights in the source channel.",
+    "USER_NOT_PARTICIPANT": "❌ **Error:** Bot is not a member of the source channel. Please add it.",
+    "MESSAGE_ID_INVALID": "❌ **Error:** Message not found or invalid message ID.",
+    "CHANNEL_PRIVATE": "❌ **Error:** Cannot access private channel. This bot only supports public channels.",
+    "PEER_ID_INVALID": "❌ **Error:** Invalid channel/chat ID. Make sure the link is correct.",
+    "FLOOD_WAIT": "❌ **Error:** Rate limited by Telegram. Please try again later.",
+    "TIMEOUT": "❌ **Error:** Telegram took too long to respond. Please try again.",
+    "Message is empty": "❌ **Error:** The message appears to be empty or has no content to copy.",
+}
+# Pyrogram exception class -> _ERROR_RESPONSES key; looked up along the MRO
+_ERROR_CLASSES: Dict[Type[Exception], str] = {
+    ChatAdminRequired: "CHAT_ADMIN_REQUIRED",
+    UserNotParticipant: "USER_NOT_PARTICIPANT",
+    MessageIdInvalid: "MESSAGE_ID_INVALID",
+    ChannelPrivate: "CHANNEL_PRIVATE",
+    PeerIdInvalid: "PEER_ID_INVALID",
+    FloodWait: "FLOOD_WAIT",
+    asyncio.TimeoutError: "TIMEOUT",
+}
+# Only for failures that arrive as text (our own messages, wrapped strings)
+_ERROR_RE = re.compile("|".join(re.escape(k) for k in _ERROR_RESPONSES))
+
+def _classify_error(error: CopyError) -> str:
+    """Reduce a copy failure to its _ERROR_RESPONSES key (or "Other")."""
+    if isinstance(error, Exception):
+        for cls in type(error).__mro__:
+            key = _ERROR_CLASSES.get(cls)
+            if key:
+                return key
+        return "Other"
+    match = _ERROR_RE.search(error)
+    return match.group(0) if match else "Other"
+
+class DebouncedEditor:
+    """
+    Coalesces rapid progress updates to one status message.
+    
+    schedule() only records the latest text; one background flush sends it
+    at most once per `interval` seconds, skipping text that is already shown.
+    Call cancel() before the final edit so a late flush can't overwrite it.
+    """
+    
+    def __init__(self, status_msg: Message, interval: float = 2.0):
+        self.status_msg = status_msg
+        self.interval = interval
+        self._text: Optional[str] = None
+        self._sent: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    def schedule(self, text: str) -> None:
+        """Queue `text` for the next flush, starting a flush timer if none is running."""
+        self._text = text
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_after())
+    
+    async def _flush_after(self) -> None:
+        try:
+            await asyncio.sleep(self.interval)
+            text = self._text
+            if text is None or text == self._sent:
+                return
+            self._sent = text
+            await self.status_msg.edit(text)
+        except MessageNotModified:
+            pass
+        except Exception as e:
+            # Best-effort: also covers network errors, which would otherwise end
+            # up as "Task exception was never retrieved"
+            logger.debug("Progress edit failed: %s", e)
+        finally:
+            self._task = None
+    
+    def cancel(self) -> None:
+        """Drop any pending flush."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+async def handle_copy_error(status_msg: Message, error: CopyError) -> None:
+    if isinstance(error, MessageNotModified):
         logger.warning("Ignoring 'MESSAGE_NOT_MODIFIED' error.")
         return
-    error_responses = {
-        "CHAT_ADMIN_REQUIRED": "❌ **Error:** Bot needs admin rights in the source channel.",
-        "USER_NOT_PARTICIPANT": "❌ **Error:** Bot is not a member of the source channel. Please add it.",
-        "MESSAGE_ID_INVALID": "❌ **Error:** Message not found or invalid message ID.",
-        "CHANNEL_PRIVATE": "❌ **Error:** Cannot access private channel. This bot only supports public channels.",
-        "PEER_ID_INVALID": "❌ **Error:** Invalid channel/chat ID. Make sure the link is correct.",
-        "FLOOD_WAIT": "❌ **Error:** Rate limited by Telegram. Please try again later.",
-        "Message is empty": "❌ **Error:** The message appears to be empty or has no content to copy.",
-    }
-    for error_type, response in error_responses.items():
-        if error_type in error_msg:
-            try:
-                await status_msg.edit(response)
-            except MessageNotModified:
-                pass
-            return
+    key = _classify_error(error)
+    if isinstance(error, FloodWait):
+        text = f"❌ **Error:** Rate limited by Telegram. Please try again in {error.value}s."
+    elif key != "Other":
+        text = _ERROR_RESPONSES[key]
+    else:
+        text = f"❌ **An unexpected error occurred:**\n`{error}`"
     try:
-        await status_msg.edit(f"❌ **An unexpected error occurred:**\n`{error_msg}`")
+        await status_msg.edit(text)
     except MessageNotModified:
         pass
 
 
+# ==================== BOT TEXTS ====================
+
+_BANNED_TEXT = "❌ আপনি এই বটটি ব্যবহার করা থেকে নিষিদ্ধ (banned)।"
+
+_WELCOME_TEXT = (
+    "🤖 **Content Saver Bot** (v3.1.1)\n\n" # <-- Version updated
+    "📋 **How to use:**\n"
+    "• Send any **public** Telegram message link\n"
+    "• Bot will fetch and forward the content to you\n\n"
+    "⚠️ **Restrictions:**\n"
+    "• **Private** channels/groups are **not** supported.\n"
+    "• **Topic** links are **not** supported.\n\n"
+    "**--- NEW: Batch Saving ---**\n"
+    "Send links in `from-to` format:\n"
+    "`https://t.me/channel/100-110`\n"
+    "(Maximum **100** posts at a time)\n\n"
+    "For more details, send /batch_download\n\n"
+    "✅ **Ready to save content!**"
+)
+
+_BATCH_HELP_TEXT = (
+    "📤 **Batch Saving Guide**\n\n"
+    "To save multiple posts at once, send the link in a `from-to` format.\n\n"
+    "**Example (Public Channel):**\n"
+    "`https://t.me/channel_username/1001-1010`\n\n"
+    "ℹ️ **Notes:**\n"
+    "• Spaces in the range (`101 - 120`) will also work.\n"
+    "• The maximum allowed range is **100** posts at a time.\n"
+    "• Only public channels/groups are supported.\n\n"
+    "To stop a batch process, send /cancel"
+)
+
+_BAN_HELP_TEXT = (
+    "**How to Ban/Unban:**\n\n"
+    "To ban a user, send:\n"
+    "`/ban 12345678`\n\n"
+    "To unban a user, send:\n"
+    "`/unban 12345678`\n\n"
+    "(Replace `12345678` with the user's Telegram ID)"
+)
+
+
 # ==================== BOT COMMAND HANDLERS ====================
 
 if app:
@@ -434,27 +1049,11 @@ if app:
         user_data = await add_or_update_user(user, is_start=True)
         
         if user_data and user_data.get('is_banned', False):
-            await message.reply("❌ আপনি এই বটটি ব্যবহার করা থেকে নিষিদ্ধ (banned)।")
-            logger.warning(f"Banned user {user.id} tried to /start")
+            spawn(message.reply(_BANNED_TEXT))
+            logger.warning("Banned user %s tried to /start", user.id)
             return
         
-        # (Your existing welcome text)
-        welcome_text = (
-            "🤖 **Content Saver Bot** (v3.1.1)\n\n" # <-- Version updated
-            "📋 **How to use:**\n"
-            "• Send any **public** Telegram message link\n"
-            "• Bot will fetch and forward the content to you\n\n"
-            "⚠️ **Restrictions:**\n"
-            "• **Private** channels/groups are **not** supported.\n"
-            "• **Topic** links are **not** supported.\n\n"
-            "**--- NEW: Batch Saving ---**\n"
-            "Send links in `from-to` format:\n"
-            "`https://t.me/channel/100-110`\n"
-            "(Maximum **100** posts at a time)\n\n"
-            "For more details, send /batch_download\n\n"
-            "✅ **Ready to save content!**"
-        )
-        await message.reply(welcome_text)
+        spawn(message.reply(_WELCOME_TEXT))
         # Logger info is now inside add_or_update_user()
     
     
@@ -466,25 +1065,12 @@ if app:
         Checks for ban status.
         """
         # --- NEW: Ban check ---
-        user_data = await get_user_data(message.from_user.id)
-        if user_data and user_data.get('is_banned', False):
-            await message.reply("❌ আপনি এই বটটি ব্যবহার করা থেকে নিষিদ্ধ (banned)।")
+        if await is_banned_cached(message.from_user.id):
+            spawn(message.reply(_BANNED_TEXT))
             return
         
-        # (Your existing batch help text)
-        batch_help_text = (
-            "📤 **Batch Saving Guide**\n\n"
-            "To save multiple posts at once, send the link in a `from-to` format.\n\n"
-            "**Example (Public Channel):**\n"
-            "`https://t.me/channel_username/1001-1010`\n\n"
-            "ℹ️ **Notes:**\n"
-            "• Spaces in the range (`101 - 120`) will also work.\n"
-            "• The maximum allowed range is **100** posts at a time.\n"
-            "• Only public channels/groups are supported.\n\n"
-            "To stop a batch process, send /cancel"
-        )
-        await message.reply(batch_help_text)
-        logger.info(f"User {message.from_user.id} requested batch help")
+        spawn(message.reply(_BATCH_HELP_TEXT))
+        logger.info("User %s requested batch help", message.from_user.id)
     
     
     # --- MODIFIED: /cancel command handler ---
@@ -497,39 +1083,38 @@ if app:
         user_id = message.from_user.id
         
         # --- NEW: Ban check ---
-        user_data = await get_user_data(user_id)
-        if user_data and user_data.get('is_banned', False):
-            await message.reply("❌ আপনি এই বটটি ব্যবহার করা থেকে নিষিদ্ধ (banned)।")
+        if await is_banned_cached(user_id):
+            spawn(message.reply(_BANNED_TEXT))
             return
             
         # (Your existing cancel logic)
-        if ACTIVE_BATCHES.get(user_id) is False:
-            ACTIVE_BATCHES[user_id] = True 
-            await message.reply("Requesting cancellation... The batch will stop shortly.")
-            logger.info(f"User {user_id} requested batch cancellation")
-        elif ACTIVE_BATCHES.get(user_id) is True:
-            await message.reply("Cancellation is already in progress...")
+        cancel_ev = CANCEL_EVENTS.get(user_id)
+        if cancel_ev and not cancel_ev.is_set():
+            cancel_ev.set()
+            spawn(message.reply("Requesting cancellation... The batch will stop shortly."))
+            logger.info("User %s requested batch cancellation", user_id)
+        elif cancel_ev:
+            spawn(message.reply("Cancellation is already in progress..."))
         else:
-            await message.reply("You have no active batch operation to cancel.")
-            logger.warning(f"User {user_id} tried to cancel with no active batch")
+            spawn(message.reply("You have no active batch operation to cancel."))
+            logger.warning("User %s tried to cancel with no active batch", user_id)
     
     
     # ==================== NEW: ADMIN COMMANDS ====================
     
-    @app.on_message(filters.command("admin") & filters.private & ~filters.me)
+    @app.on_message(filters.command("admin") & filters.private & ~filters.me & owner_only)
     async def admin_panel_command(client: Client, message: Message):
         """
         Display the admin panel with stats and user management buttons.
-        Restricted to OWNER_ID.
+        Restricted to OWNER_ID (non-owners are dropped by the owner_only filter).
         """
-        if not is_owner(message.from_user.id):
-            return # Ignore silently if not owner
-        
         try:
             total_users = await get_user_count()
             
-            text = f"👮‍♂️ **Admin Panel**\n\n"
-            text += f"📊 **Total Users:** `{total_users}`"
+            text = (
+                "👮‍♂️ **Admin Panel**\n\n"
+                f"📊 **Total Users:** `{total_users}`"
+            )
             
             keyboard = InlineKeyboardMarkup(
                 [
@@ -543,62 +1128,60 @@ if app:
                 ]
             )
             await message.reply(text, reply_markup=keyboard)
-        except Exception as e:
+        except RPCError as e:
             await message.reply(f"❌ Error fetching admin stats: {e}")
-            logger.error(f"Error in /admin: {e}")
+            logger.error("Error in /admin: %s", e)
 
-    @app.on_message(filters.command("ban") & filters.private & ~filters.me)
+    @app.on_message(filters.command("ban") & filters.private & ~filters.me & owner_only)
     async def ban_user_command(client: Client, message: Message):
         """
         Ban a user by their ID.
-        Restricted to OWNER_ID.
+        Restricted to OWNER_ID (non-owners are dropped by the owner_only filter).
         """
-        if not is_owner(message.from_user.id):
+        # Validate the argument up front; bad input never reaches the try block
+        parts = message.text.split()
+        if len(parts) < 2:
+            await message.reply("Usage: `/ban [USER_ID]`")
+            return
+        if not parts[1].isdecimal():
+            await message.reply("❌ Invalid User ID. It must be a number.")
             return
         
+        user_id_to_ban = int(parts[1])
         try:
-            parts = message.text.split()
-            if len(parts) < 2:
-                await message.reply("Usage: `/ban [USER_ID]`")
-                return
-            
-            user_id_to_ban = int(parts[1])
             success, msg = await set_ban_status(user_id_to_ban, True)
             
             if success:
                 await message.reply(f"✅ User `{user_id_to_ban}` has been **banned**.")
             else:
                 await message.reply(f"❌ Failed to ban user `{user_id_to_ban}`: {msg}")
-        except ValueError:
-            await message.reply("❌ Invalid User ID. It must be a number.")
-        except Exception as e:
+        except RPCError as e:
             await message.reply(f"❌ Error during banning: {e}")
 
-    @app.on_message(filters.command("unban") & filters.private & ~filters.me)
+    @app.on_message(filters.command("unban") & filters.private & ~filters.me & owner_only)
     async def unban_user_command(client: Client, message: Message):
         """
         Unban a user by their ID.
-        Restricted to OWNER_ID.
+        Restricted to OWNER_ID (non-owners are dropped by the owner_only filter).
         """
-        if not is_owner(message.from_user.id):
+        # Validate the argument up front; bad input never reaches the try block
+        parts = message.text.split()
+        if len(parts) < 2:
+            await message.reply("Usage: `/unban [USER_ID]`")
             return
-
+        if not parts[1].isdecimal():
+            await message.reply("❌ Invalid User ID. It must be a number.")
+            return
+        
+        user_id_to_unban = int(parts[1])
         try:
-            parts = message.text.split()
-            if len(parts) < 2:
-                await message.reply("Usage: `/unban [USER_ID]`")
-                return
-            
-            user_id_to_unban = int(parts[1])
             success, msg = await set_ban_status(user_id_to_unban, False)
             
             if success:
                 await message.reply(f"✅ User `{user_id_to_unban}` has been **unbanned**.")
             else:
                 await message.reply(f"❌ Failed to unban user `{user_id_to_unban}`: {msg}")
-        except ValueError:
-            await message.reply("❌ Invalid User ID. It must be a number.")
-        except Exception as e:
+        except RPCError as e:
             await message.reply(f"❌ Error during unbanning: {e}")
 
     # ==================== NEW: ADMIN CALLBACK HANDLER ====================
@@ -606,7 +1189,8 @@ if app:
     @app.on_callback_query()
     async def admin_callback_handler(client: Client, callback_query):
         """Handle all callback queries from the admin panel."""
-        if not is_owner(callback_query.from_user.id):
+        # OWNER_ID is a plain int or None, and no user id equals None
+        if callback_query.from_user.id != OWNER_ID:
             await callback_query.answer("❌ This is for the admin only.", show_alert=True)
             return
 
@@ -616,8 +1200,10 @@ if app:
             if data == "admin_stats":
                 # Refresh stats
                 total_users = await get_user_count()
-                text = f"👮‍♂️ **Admin Panel**\n\n"
-                text += f"📊 **Total Users:** `{total_users}`"
+                text = (
+                    "👮‍♂️ **Admin Panel**\n\n"
+                    f"📊 **Total Users:** `{total_users}`"
+                )
                 
                 await callback_query.message.edit_text(text, reply_markup=callback_query.message.reply_markup)
                 await callback_query.answer("Stats refreshed!")
@@ -625,85 +1211,110 @@ if app:
             elif data == "view_all_users":
                 # Send a list of all users as a file
                 await callback_query.answer("Please wait, fetching all users...")
-                users_list = await get_all_users_from_db()
-                
-                if not users_list:
+
+                # Write rows straight into the upload buffer as each page
+                # arrives; csv handles quoting of commas in names.
+                f = io.BytesIO()
+                text_io = io.TextIOWrapper(f, encoding='utf-8', newline='', write_through=True)
+                writer = csv.writer(text_io)
+                writer.writerow(["USER_ID", "FIRST_NAME", "USERNAME", "IS_BANNED"])
+                total = 0
+                try:
+                    async for doc in iter_users():
+                        user = doc.to_dict()
+                        writer.writerow([
+                            doc.id,
+                            user.get('first_name', 'N/A'),
+                            user.get('username', 'N/A'),
+                            user.get('is_banned', 'N/A'),
+                        ])
+                        total += 1
+                except Exception as e:
+                    # The query is already answered, so report by message, not a second answer()
+                    logger.error("Failed to export users: %s", e)
+                    await callback_query.message.reply(f"❌ Failed to fetch users from the database: {e}")
+                    return
+                finally:
+                    text_io.detach()
+
+                if not total:
                     await callback_query.message.reply("No users found in the database.")
                     return
 
-                # Create a text file in memory
-                output = "USER_ID,FIRST_NAME,USERNAME,IS_BANNED\n"
-                for user in users_list:
-                    # Format data for CSV
-                    user_id = user.get('user_id', 'N/A')
-                    first_name = str(user.get('first_name', 'N/A')).replace(',', '') # Remove commas
-                    username = str(user.get('username', 'N/A')).replace(',', '')
-                    is_banned = user.get('is_banned', 'N/A')
-                    output += f"{user_id},{first_name},{username},{is_banned}\n"
-                
                 # Send the file
-                with io.BytesIO(output.encode('utf-8')) as f:
+                with f:
+                    f.seek(0)
                     f.name = "all_users.csv"
                     await callback_query.message.reply_document(
                         document=f,
-                        caption=f"Here is the list of all {len(users_list)} users."
+                        caption=f"Here is the list of all {total} users."
                     )
             
             elif data == "admin_help_ban":
                 await callback_query.answer() # Close the "loading"
-                await callback_query.message.reply(
-                    "**How to Ban/Unban:**\n\n"
-                    "To ban a user, send:\n"
-                    "`/ban 12345678`\n\n"
-                    "To unban a user, send:\n"
-                    "`/unban 12345678`\n\n"
-                    "(Replace `12345678` with the user's Telegram ID)"
-                )
+                await callback_query.message.reply(_BAN_HELP_TEXT)
                 
         except MessageNotModified:
             await callback_query.answer() # Acknowledge
         except Exception as e:
-            logger.error(f"Error in admin callback: {e}", exc_info=True)
+            logger.error("Error in admin callback: %s", e)
+            logger.debug("Traceback for admin callback error", exc_info=True)
             await callback_query.answer(f"Error: {e}", show_alert=True)
     
     
     # ==================== MAIN MESSAGE HANDLER ====================
     
+    # Link detection happens in the dispatcher; the handlers below never re-run the regex
+    @app.on_message(non_link_message)
+    async def handle_non_link(client: Client, message: Message):
+        """Reply with a (throttled) hint to text messages that carry no link."""
+        user = message.from_user
+        if await is_banned_cached(user.id):
+            return
+        queue_user_update(user)
+        
+        # A burst of non-link messages gets one hint, not one reply each
+        now = asyncio.get_running_loop().time()
+        if now - HINT_SENT_AT.get(message.chat.id, -HINT_COOLDOWN) >= HINT_COOLDOWN:
+            if len(HINT_SENT_AT) >= HINT_SENT_AT_MAX:
+                # An entry past its cooldown no longer suppresses anything
+                for chat_id in [c for c, t in HINT_SENT_AT.items() if now - t >= HINT_COOLDOWN]:
+                    del HINT_SENT_AT[chat_id]
+            HINT_SENT_AT[message.chat.id] = now
+            spawn(message.reply("📎 Please send a valid Telegram message link."))
+    
     # --- MODIFIED: Handles new restrictions, limit, cancellation, and BAN CHECK ---
-    @app.on_message(filters.text & ~filters.command(["start", "batch_download", "cancel", "admin", "ban", "unban"]) & filters.private & ~filters.me)
+    @app.on_message(link_message)
     async def handle_message_link(client: Client, message: Message):
         """
         Handle incoming Telegram message links (single or batch).
         This is the main functionality of the bot.
         """
-        text = message.text
         user = message.from_user
         
         # --- NEW: Add/Update user and check ban status ---
-        user_data = await add_or_update_user(user, is_start=False) # is_start=False
-        if user_data and user_data.get('is_banned', False):
+        if await is_banned_cached(user.id):
             # Do not reply, just log and ignore
-            logger.warning(f"Banned user {user.id} tried to send a link. Ignoring.")
+            logger.warning("Banned user %s tried to send a link. Ignoring.", user.id)
             return
+        queue_user_update(user) # Batched last_seen write; doesn't block the reply
 
         # (Your existing link processing logic)
         
-        if not any(domain in text for domain in ['t.me/', 'telegram.me/']):
-            await message.reply("📎 Please send a valid Telegram message link.")
-            return
-        
-        link_pattern = r'https?://(?:t\.me|telegram\.me)/\S+'
-        link_match = re.search(link_pattern, text)
-        
-        if not link_match:
-            await message.reply("❌ No valid Telegram link found in your message.")
-            return
-        
-        telegram_link = link_match.group()
-        logger.info(f"Processing link from user {user.id}: {telegram_link}")
+        # Match found by the link_message filter
+        telegram_link = message.matches[0].group()
+        logger.info("Processing link from user %s: %s", user.id, telegram_link)
         
         status_msg = await message.reply("🔄 Processing your request...")
         
+        # The copy runs on the chat's own worker, so this dispatcher worker is free
+        # for the next update and links from one chat are handled in order
+        enqueue_for_chat(message.chat.id, process_link(client, message, status_msg, telegram_link))
+    
+    async def process_link(client: Client, message: Message, status_msg: Message, telegram_link: str):
+        """Parse a link and copy the message or range it points to, reporting on status_msg."""
+        user = message.from_user
+        
         try:
             parsed_link = parse_telegram_link(telegram_link)
             
@@ -729,73 +1340,153 @@ if app:
                 await status_msg.edit(f"❌ **Error:** Range too large. Max **{BATCH_LIMIT}** posts at a time. You requested {num_messages}.")
                 return
             
-            chat_id = parsed_link["channel"]
-            topic_id = None 
+            chat_id = await resolve_chat_id(client, parsed_link["channel"])
+            to_chat_id = message.chat.id
+            limiter = get_rate_limiter(to_chat_id)
+            
+            # Single link: one copy, no cancel tracking, prefetch or job planning
+            if num_messages == 1:
+                async with limiter.send_lock:
+                    await limiter.acquire()
+                    _, error = await copy_message_with_fallback(client, chat_id, msg_start, to_chat_id)
+                if error:
+                    await handle_copy_error(status_msg, error)
+                else:
+                    await status_msg.edit("✅ Content saved successfully!")
+                return
             
             success_count = 0
             fail_count = 0
-            last_error = None
+            error_counter: Counter = Counter()
             
-            ACTIVE_BATCHES[user.id] = False
+            # Only batches can be cancelled, so only they register an event
+            cancel_ev = asyncio.Event()
+            CANCEL_EVENTS[user.id] = cancel_ev
+            try:
+                # Fetch the range in as few requests as possible instead of one per message.
+                # (get_chat_history would also be one call, but bots can't use it:
+                # messages.getHistory answers BOT_METHOD_INVALID.)
+                originals_by_id = await fetch_messages(client, chat_id, range(msg_start, msg_end + 1))
             
-            if num_messages > 1:
-                await status_msg.edit(f"🔄 Processing {num_messages} messages... (Send /cancel to stop)")
-
-            for msg_id in range(msg_start, msg_end + 1):
-                
-                if ACTIVE_BATCHES.get(user.id, False):
-                    logger.info(f"Batch cancelled by user {user.id} at msg {msg_id}")
-                    await status_msg.edit("🛑 **Batch operation cancelled by user.**")
-                    fail_count = (msg_end + 1) - msg_id
-                    break
-                
-                copied_msg, error = await copy_message_with_fallback(
-                    client=client,
-                    from_chat_id=chat_id,
-                    message_id=msg_id,
-                    to_chat_id=message.chat.id,
-                    message_thread_id=topic_id
+                async def run_job(job: List[int]) -> List[Tuple[int, Optional[CopyError]]]:
+                    if cancel_ev.is_set():
+                        return [(msg_id, "Cancelled") for msg_id in job]
+                    results = []
+                    # Held for the whole job, so no other send to this chat interleaves with it
+                    async with limiter.send_lock:
+                        if cancel_ev.is_set(): # May have been set while waiting for the lock
+                            return [(msg_id, "Cancelled") for msg_id in job]
+                        try:
+                            if len(job) > 1:
+                                await limiter.acquire()
+                                error = await send_album(client, [originals_by_id[i] for i in job], to_chat_id)
+                                if not error:
+                                    return [(msg_id, None) for msg_id in job]
+                                if isinstance(error, asyncio.TimeoutError):
+                                    # The album may have landed; re-copying could duplicate it
+                                    return [(msg_id, error) for msg_id in job]
+                                logger.warning("send_media_group failed, copying %d messages one by one: %s", len(job), error)
+                            for msg_id in job:
+                                if cancel_ev.is_set():
+                                    results.append((msg_id, "Cancelled"))
+                                    continue
+                                await limiter.acquire()
+                                _, error = await copy_prefetched(
+                                    client=client,
+                                    original_msg=originals_by_id.get(msg_id),
+                                    to_chat_id=to_chat_id,
+                                    from_chat_id=chat_id,
+                                    message_id=msg_id
+                                )
+                                results.append((msg_id, error))
+                        except Exception as e:
+                            # Like gather(return_exceptions=True): fail this job, keep the batch going
+                            logger.error("Batch job %s-%s failed: %s", job[0], job[-1], e)
+                            finished = {msg_id for msg_id, _ in results}
+                            results.extend((msg_id, e) for msg_id in job if msg_id not in finished)
+                    return results
+            
+                # Runs of photos/videos, documents or audio go out as albums of up to 10
+                jobs = plan_send_jobs(range(msg_start, msg_end + 1), originals_by_id)
+                progress = DebouncedEditor(status_msg)
+            
+                # Jobs run one at a time, in source order. Racing each job against the
+                # cancel event makes /cancel take effect at once, even mid-send.
+                cancel_waiter = asyncio.create_task(cancel_ev.wait())
+                current_job: Optional[asyncio.Task] = None
+                # Not awaited here: the edit's round trip overlaps the first sends
+                start_edit = asyncio.create_task(
+                    status_msg.edit(f"🔄 Processing {num_messages} messages... (Send /cancel to stop)")
                 )
-                
-                if error:
-                    fail_count += 1
-                    last_error = error
-                    logger.warning(f"Failed to copy message {msg_id}: {error}")
-                else:
-                    success_count += 1
-                    logger.info(f"Successfully copied message {msg_id} for user {user.id}")
-                
-                if num_messages > 1:
-                    await asyncio.sleep(0.5) 
+                try:
+                    for job in jobs:
+                        current_job = asyncio.create_task(run_job(job))
+                        done, _ = await asyncio.wait(
+                            {current_job, cancel_waiter}, return_when=asyncio.FIRST_COMPLETED
+                        )
+                    
+                        if cancel_waiter in done:
+                            break
+                    
+                        for msg_id, error in current_job.result():
+                            if error:
+                                fail_count += 1
+                                error_counter[_classify_error(error)] += 1
+                                logger.debug("Failed to copy message %s: %s", msg_id, error)
+                            else:
+                                success_count += 1
+                                logger.debug("Successfully copied message %s for user %s", msg_id, user.id)
+                    
+                        progress.schedule(
+                            f"🔄 Processed {success_count + fail_count}/{num_messages} messages... (Send /cancel to stop)"
+                        )
+                finally:
+                    progress.cancel() # The summary/cancel edit below is final
+                    cancel_waiter.cancel()
+                    if current_job is not None:
+                        current_job.cancel()
+                    # Settle the start edit before any final edit can race it
+                    try:
+                        await start_edit
+                    except RPCError as e:
+                        logger.debug("Initial status edit failed: %s", e)
             
-            if num_messages == 1 and not ACTIVE_BATCHES.get(user.id, False):
-                if success_count == 1:
-                    success_msg = "✅ Content saved successfully!"
-                    await status_msg.edit(success_msg)
+                if cancel_ev.is_set():
+                    logger.info("Batch cancelled by user %s after %d messages", user.id, success_count + fail_count)
+                    await status_msg.edit(
+                        "🛑 **Batch operation cancelled by user.**\n\n"
+                        f"• Saved before cancel: {success_count}/{num_messages}"
+                    )
                 else:
-                    await handle_copy_error(status_msg, Exception(last_error))
-            elif not ACTIVE_BATCHES.get(user.id, False):
-                # Batch summary
-                # --- THIS IS THE FIX ---
-                await status_msg.edit(
-                    f"✅ **Batch Complete**\n\n"
-                    f"• Successfully saved: {success_count}\n"
-                    f"• Failed to save: {fail_count}" # <-- FIX: Removed the typo 'f•' and made it a valid string
-                )
+                    # Batch summary
+                    # --- THIS IS THE FIX ---
+                    summary_lines = [
+                        "✅ **Batch Complete**\n",
+                        f"• Successfully saved: {success_count}",
+                        f"• Failed to save: {fail_count}", # <-- FIX: Removed the typo 'f•' and made it a valid string
+                    ]
+                    if error_counter:
+                        summary_lines.append("\n**Failure reasons:**")
+                        summary_lines.extend(
+                            f"• `{reason}`: {count}" for reason, count in error_counter.most_common()
+                        )
+                    await status_msg.edit("\n".join(summary_lines))
+            finally:
+                # Only unregister our own event; a newer batch may have replaced it
+                if CANCEL_EVENTS.get(user.id) is cancel_ev:
+                    del CANCEL_EVENTS[user.id]
         
         except Exception as e:
             await handle_copy_error(status_msg, e)
-            logger.error(f"Unexpected error processing link: {e}", exc_info=True)
-        
-        finally:
-            ACTIVE_BATCHES.pop(user.id, None)
+            logger.error("Unexpected error processing link: %s", e)
+            logger.debug("Traceback for link processing error", exc_info=True)
 
 
 # ==================== MODULE EXPORTS ====================
 
-# Export the app instance and BOT_TOKEN for use in main.py
+# Export the app instance and BOT_TOKEN for use in main.py.
+# BOT_TOKEN is the value resolved once at import; consumers should use it, not Config.
 __all__ = ['app', 'BOT_TOKEN']
-BOT_TOKEN = Config.BOT_TOKEN
 
 logger.info("Bot module v3.1.1 (Admin+Firebase+Fix) loaded successfully")
 
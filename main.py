@@ -1,5 +1,6 @@
 import logging
 import os
+import json
 import asyncio
 import aiohttp
 from fastapi import FastAPI, Request, Response
@@ -14,6 +15,13 @@ except ImportError:
     app = None
     BOT_TOKEN = None
 
+# --- Optional: msgspec for decoding update bodies, stdlib json otherwise ---
+try:
+    import msgspec
+    decode_update = msgspec.json.decode
+except ImportError:
+    decode_update = json.loads
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -35,6 +43,25 @@ FULL_WEBHOOK_URL = f"{WEBHOOK_URL}{WEBHOOK_PATH}" if WEBHOOK_URL and BOT_TOKEN e
 # --- Lazy App Startup ---
 app_is_running = False
 
+# --- Shared HTTP session ---
+# One pooled session for all outbound Bot API calls, created on first use
+# (it must be bound to the running event loop) and closed on shutdown.
+http_session = None
+
+def get_http_session():
+    """Return the shared aiohttp session, creating it on first use."""
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300, keepalive_timeout=60)
+        )
+    return http_session
+
+def log_event_loop():
+    """Log which event loop implementation the bot is actually running on."""
+    loop = asyncio.get_running_loop()
+    log.info("Running on event loop %s.%s", type(loop).__module__, type(loop).__qualname__)
+
 # Initialize the FastAPI server
 server = FastAPI(docs_url=None, redoc_url=None)
 
@@ -47,6 +74,8 @@ async def on_shutdown():
         await app.stop()
         log.info("Pyrogram client stopped.")
         app_is_running = False
+    if http_session and not http_session.closed:
+        await http_session.close()
 
 # === সমাধান ১: UptimeRobot (405 Method Not Allowed + TypeError) ===
 # @server.get() এর বদলে @server.api_route() ব্যবহার করা হয়েছে,
@@ -80,9 +109,10 @@ async def webhook_listener(request: Request):
             await app.start()
             app_is_running = True
             log.info("Pyrogram client started.")
+            log_event_loop()
 
         # Get the update data from the request body
-        json_data = await request.json()
+        json_data = decode_update(await request.body())
         
         # === সমাধান ৩: মেসেজ প্রসেসিং (AttributeError: 'Update' has no attribute 'from_dict') ===
         # Pyrogram-এর ডকুমেন্টেশন অনুযায়ী, raw JSON ডেটা প্রসেস করার
@@ -112,19 +142,19 @@ async def setup_webhook():
             log.info("Setting up webhook, starting client...")
             await app.start()
             app_is_running = True
+            log_event_loop()
 
         log.info(f"Setting webhook to {FULL_WEBHOOK_URL}...")
         api_url = f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook?url={FULL_WEBHOOK_URL}"
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(api_url) as resp:
-                response_json = await resp.json()
-                if resp.status == 200 and response_json.get("ok"):
-                    log.info("Webhook set successfully.")
-                    return {"ok": True, "message": "Webhook set successfully!"}
-                else:
-                    log.error(f"Failed to set webhook: {response_json.get('description', 'Unknown error')}")
-                    return {"ok": False, "error": response_json.get('description', 'Unknown error')}
+        async with get_http_session().get(api_url) as resp:
+            response_json = await resp.json()
+            if resp.status == 200 and response_json.get("ok"):
+                log.info("Webhook set successfully.")
+                return {"ok": True, "message": "Webhook set successfully!"}
+            else:
+                log.error(f"Failed to set webhook: {response_json.get('description', 'Unknown error')}")
+                return {"ok": False, "error": response_json.get('description', 'Unknown error')}
     except Exception as e:
         log.error(f"Error setting webhook: {e}")
         return {"ok": False, "error": str(e)}